@@ -1,43 +1,58 @@
 from fastapi import FastAPI, Depends, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, Response
 from fastapi.templating import Jinja2Templates
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
 from typing import List, Optional
 from contextlib import asynccontextmanager
-import json
 import os
 from datetime import datetime
 
 from models.database import get_db, create_tables, ChatHistory
 from services.recommendation_service import RecommendationService
+from services.serialization import dumps, Fragment, FastJSONResponse
+from services.http_cache import PayloadCache
+from services.static_assets import AssetUrls, PrecompressedStaticFiles
 
 # Initialize recommendation service
 recommendation_service = RecommendationService()
 
+# Encoded payloads for the cacheable endpoints (/, /clusters, /location)
+payload_cache = PayloadCache(max_entries=256)
+API_CACHE_CONTROL = "public, max-age=300"
+PAGE_CACHE_CONTROL = "no-cache"
+
+# Resolves static asset names to their fingerprinted build output
+static_url = AssetUrls(static_dir="static")
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
     create_tables()
+    static_url.reload()
+    if not static_url.manifest:
+        print("Static assets not built; run `python -m services.static_assets` to enable compression")
     print("Initializing recommendation system...")
     if recommendation_service.load_and_prepare_data():
         recommendation_service.train_clustering_model()
         print("Recommendation system ready!")
     else:
         print("Warning: Could not initialize recommendation system")
+    payload_cache.clear()
     yield
     # Shutdown
     print("Shutting down...")
 
 # Initialize FastAPI app
-app = FastAPI(title="Vietnam Travel Chatbot", version="1.0.0", lifespan=lifespan)
+app = FastAPI(title="Vietnam Travel Chatbot", version="1.0.0", lifespan=lifespan,
+              default_response_class=FastJSONResponse)
 
 # Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", PrecompressedStaticFiles(directory="static"), name="static")
 
 # Initialize templates
 templates = Jinja2Templates(directory="templates")
+templates.env.globals["static_url"] = static_url
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -55,59 +70,77 @@ class ChatResponse(BaseModel):
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     """Serve the main page"""
-    return templates.TemplateResponse("index.html", {"request": request})
+    payload = payload_cache.get("page:index")
+    if payload is None:
+        html = templates.get_template("index.html").render({"request": request})
+        payload = payload_cache.put("page:index", html.encode("utf-8"), media_type="text/html")
+    return payload.response(request, PAGE_CACHE_CONTROL)
 
 @app.post("/chat", response_model=ChatResponse)
 async def chat_endpoint(chat_message: ChatMessage, db: Session = Depends(get_db)):
     """Main chat endpoint"""
     try:
         # Get recommendations from the service
-        result = recommendation_service.get_recommendations(chat_message.message)
+        result = recommendation_service.get_recommendations(chat_message.message, chat_message.user_id)
 
         if "error" in result:
             raise HTTPException(status_code=500, detail=result["error"])
 
+        # Encode recommendations once; the same bytes go to the database
+        # and are embedded verbatim in the response body
+        recommendations_json = dumps(result["recommendations"])
+
         # Save chat history to database
         chat_history = ChatHistory(
             user_message=chat_message.message,
             bot_response=result["response"],
-            recommended_locations=json.dumps(result["recommendations"], ensure_ascii=False),
+            recommended_locations=recommendations_json.decode("utf-8"),
             user_id=chat_message.user_id
         )
         db.add(chat_history)
         db.commit()
 
-        return ChatResponse(
-            response=result["response"],
-            recommendations=result["recommendations"],
-            preferences=result["preferences"],
-            timestamp=datetime.now()
-        )
+        # Body matches ChatResponse; it is encoded directly instead of being
+        # validated and serialized again by the response model
+        body = dumps({
+            "response": result["response"],
+            "recommendations": Fragment(recommendations_json),
+            "preferences": result["preferences"],
+            "timestamp": datetime.now()
+        })
+        return Response(content=body, media_type="application/json")
 
     except Exception as e:
         print(f"Chat endpoint error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/location/{location_name}")
-async def get_location_details(location_name: str):
+async def get_location_details(location_name: str, request: Request):
     """Get detailed information about a specific location"""
     try:
-        details = recommendation_service.get_location_details(location_name)
-        if details is None:
-            raise HTTPException(status_code=404, detail="Location not found")
-        return details
+        cache_key = f"location:{location_name}"
+        payload = payload_cache.get(cache_key)
+        if payload is None:
+            details = recommendation_service.get_location_details(location_name)
+            if details is None:
+                raise HTTPException(status_code=404, detail="Location not found")
+            payload = payload_cache.put(cache_key, dumps(details))
+        return payload.response(request, API_CACHE_CONTROL)
     except Exception as e:
         print(f"Location details error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
 @app.get("/clusters")
-async def get_cluster_analysis():
+async def get_cluster_analysis(request: Request):
     """Get cluster analysis information"""
     try:
-        clusters = recommendation_service.get_cluster_analysis()
-        if clusters is None:
-            raise HTTPException(status_code=500, detail="Clustering model not ready")
-        return {"clusters": clusters}
+        payload = payload_cache.get("clusters")
+        if payload is None:
+            clusters = recommendation_service.get_cluster_analysis()
+            if clusters is None:
+                raise HTTPException(status_code=500, detail="Clustering model not ready")
+            payload = payload_cache.put("clusters", dumps({"clusters": clusters}))
+        return payload.response(request, API_CACHE_CONTROL)
     except Exception as e:
         print(f"Cluster analysis error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -117,16 +150,17 @@ async def get_chat_history(limit: int = 10, db: Session = Depends(get_db)):
     """Get recent chat history"""
     try:
         history = db.query(ChatHistory).order_by(ChatHistory.timestamp.desc()).limit(limit).all()
-        return [
+        # Stored recommendations are already JSON, so embed them without re-parsing
+        return FastJSONResponse([
             {
                 "id": h.id,
                 "user_message": h.user_message,
                 "bot_response": h.bot_response,
                 "timestamp": h.timestamp,
-                "recommendations": json.loads(h.recommended_locations) if h.recommended_locations else []
+                "recommendations": Fragment(h.recommended_locations) if h.recommended_locations else []
             }
             for h in history
-        ]
+        ])
     except Exception as e:
         print(f"History error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
@@ -5,11 +5,39 @@ from sklearn.preprocessing import StandardScaler
 from sklearn.metrics import silhouette_score
 import pickle
 import os
+import time
+
+from models.recommendation import LocationRecommendation
+
+# Temperature percentiles kept per location and per month
+CLIMATE_QUANTILES = (0.1, 0.5, 0.9)
+
+# Daily precipitation (mm) at or above which a day counts as rainy
+RAIN_DAY_THRESHOLD_MM = 1.0
+
+# Distribution statistics produced by compute_climate_stats, besides the feature means
+CLIMATE_STAT_COLUMNS = ['temp_p10', 'temp_p50', 'temp_p90', 'rain_day_prob',
+                        'humidity_std', 'uv_p90', 'uv_max']
+
+# Days in each month, used to weight month sets (leap-year calendar, day-of-year 1..366)
+DAYS_IN_MONTH = np.array([31, 29, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+DAYS_IN_YEAR = 366
+
+# Width (days, centred) of the circular window pooling day-of-year observations;
+# a single calendar day only has one row per year of data
+DAILY_SMOOTHING_DAYS = 15
+
+# Preferences the cluster index can serve: the centroids hold yearly mean
+# temperature, which is what the scorer ranks on. Rain is scored by rainy-day
+# probability and windows, terrain and region by per-query data the centroids
+# do not describe, so queries using anything else are always full scans.
+INDEX_PREFERENCES = {'temperature'}
 
 class WeightedKMeans:
-    def __init__(self, n_clusters=8, random_state=42):
+    def __init__(self, n_clusters=8, random_state=42, nprobe=None):
         self.n_clusters = n_clusters
         self.random_state = random_state
+        self.nprobe = nprobe  # Opt-in: nearest clusters scored per query; None scans everything
         self.scaler = StandardScaler()
         self.kmeans = KMeans(n_clusters=n_clusters, random_state=random_state, n_init=10)
         self.feature_weights = {
@@ -22,6 +50,14 @@ class WeightedKMeans:
         }
         self.cluster_labels_ = None
         self.cluster_centers_ = None
+        self.location_data = None
+        self.climate_stats = None
+        self.index_weights = None  # Feature weights the cluster centers were computed with
+        self._scoring_arrays = None
+        self._window_arrays = None
+        self._cluster_members = None
+        self._terrains = None
+        self._regions = None
         
     def set_weights(self, weights_dict):
         """Update feature weights based on user preferences"""
@@ -43,6 +79,159 @@ class WeightedKMeans:
         
         return location_features
     
+    def compute_climate_stats(self, df):
+        """Aggregate daily weather into per-location, per-month and per-day-of-year statistics"""
+        feature_columns = list(self.feature_weights.keys())
+        work = df[['location.name'] + feature_columns].copy()
+        dates = pd.to_datetime(df['date'])
+        work['month'] = dates.dt.month
+        # Day of year on a leap-year calendar so a date maps to the same slot every year
+        work['day_of_year'] = dates.dt.dayofyear + ((~dates.dt.is_leap_year) & (dates.dt.month > 2))
+        work['rain_day'] = (work['day.totalprecip_mm'] >= RAIN_DAY_THRESHOLD_MM).astype(float)
+        
+        return {
+            'location': self._aggregate_climate(work, ['location.name']),
+            'monthly': self._aggregate_climate(work, ['location.name', 'month']),
+            'daily': work.groupby(['location.name', 'day_of_year']).agg(
+                temperature=('day.avgtemp_c', 'mean'),
+                precipitation=('day.totalprecip_mm', 'mean'),
+                rain_day_prob=('rain_day', 'mean'),
+                observations=('rain_day', 'size')
+            )
+        }
+    
+    def needs_climate_stats(self):
+        """Whether climate statistics are missing or predate the current layout"""
+        return (self.climate_stats is None or 'daily' not in self.climate_stats
+                or 'observations' not in self.climate_stats['daily'])
+    
+    def _aggregate_climate(self, work, keys):
+        """Vectorized groupby aggregation of climate statistics for the given keys"""
+        feature_columns = list(self.feature_weights.keys())
+        grouped = work.groupby(keys)
+        
+        aggregations = {feature: (feature, 'mean') for feature in feature_columns}
+        aggregations.update({
+            'rain_day_prob': ('rain_day', 'mean'),
+            'humidity_std': ('day.avghumidity', 'std'),
+            'uv_max': ('day.uv', 'max')
+        })
+        stats = grouped.agg(**aggregations)
+        
+        temp_quantiles = grouped['day.avgtemp_c'].quantile(list(CLIMATE_QUANTILES)).unstack()
+        temp_quantiles.columns = [f"temp_p{round(q * 100)}" for q in temp_quantiles.columns]
+        uv_p90 = grouped['day.uv'].quantile(0.9).rename('uv_p90')
+        
+        stats = pd.concat([stats, temp_quantiles, uv_p90], axis=1)
+        # A single observation has no spread
+        stats['humidity_std'] = stats['humidity_std'].fillna(0.0)
+        return stats
+    
+    def fit_climate_stats(self, df):
+        """Compute and attach climate statistics for the fitted locations"""
+        self.climate_stats = self.compute_climate_stats(df)
+        self._build_scoring_arrays()
+        return self
+    
+    def _build_scoring_arrays(self):
+        """Precompute per-month scoring arrays aligned with location_data rows"""
+        self._scoring_arrays = {}
+        self._window_arrays = None
+        if self.location_data is None:
+            return
+        
+        names = self.location_data['location.name']
+        # Fallback when climate statistics are unavailable (older model artifacts)
+        if self.climate_stats is None:
+            self._scoring_arrays[None] = {
+                'temperature': self.location_data['day.avgtemp_c'].to_numpy(dtype=float),
+                'precipitation': self.location_data['day.totalprecip_mm'].to_numpy(dtype=float),
+                'rain_day_prob': None
+            }
+            return
+        
+        overall = self.climate_stats['location'].reindex(names.values)
+        self._scoring_arrays[None] = self._scoring_columns(overall)
+        
+        monthly = self.climate_stats['monthly']
+        for month in monthly.index.get_level_values('month').unique():
+            month_stats = monthly.xs(month, level='month').reindex(names.values)
+            # Locations without observations for the month use their yearly values
+            month_stats = month_stats.fillna(overall)
+            self._scoring_arrays[int(month)] = self._scoring_columns(month_stats)
+        
+        self._build_window_arrays(names.values)
+    
+    def _build_window_arrays(self, names):
+        """Stack per-month and per-day-of-year values into (location, period) matrices"""
+        overall = self._scoring_arrays[None]
+        months = [self._scoring_arrays.get(month, overall) for month in range(1, 13)]
+        self._window_arrays = {
+            'monthly': {key: np.column_stack([columns[key] for columns in months])
+                        for key in overall},
+            'daily': None
+        }
+        
+        daily = self.climate_stats.get('daily')
+        if daily is not None and 'observations' in daily:
+            def matrix(column):
+                return (daily[column].unstack('day_of_year')
+                                     .reindex(index=names, columns=range(1, DAYS_IN_YEAR + 1))
+                                     .to_numpy(dtype=float))
+            
+            counts = np.nan_to_num(matrix('observations'))
+            pooled_counts = self._circular_window_sum(counts)
+            self._window_arrays['daily'] = {}
+            for key in overall:
+                sums = np.nan_to_num(matrix(key)) * counts
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    self._window_arrays['daily'][key] = np.where(
+                        pooled_counts > 0, self._circular_window_sum(sums) / pooled_counts, np.nan
+                    )
+    
+    def _circular_window_sum(self, values, width=DAILY_SMOOTHING_DAYS):
+        """Sum each day-of-year column with its neighbours, wrapping around the year"""
+        half = width // 2
+        padded = np.concatenate([values[:, -half:], values, values[:, :half]], axis=1)
+        cumulative = np.cumsum(np.pad(padded, ((0, 0), (1, 0))), axis=1)
+        return cumulative[:, 2 * half + 1:] - cumulative[:, :-(2 * half + 1)]
+    
+    def _build_index(self):
+        """Build the inverted lists mapping each cluster to its member rows"""
+        if self.location_data is None or self.cluster_centers_ is None:
+            self._cluster_members = None
+            return
+        
+        labels = self.location_data['cluster'].to_numpy()
+        self._cluster_members = [np.flatnonzero(labels == cluster_id)
+                                 for cluster_id in range(len(self.cluster_centers_))]
+        self._terrains = self.location_data['location.terrain'].fillna('').to_numpy(dtype=object)
+        self._regions = self.location_data['location.region'].fillna('').to_numpy(dtype=object)
+    
+    def _scoring_columns(self, stats):
+        # Mean temperature on every path: unlike the median it combines exactly
+        # across months and days, so a trip ranks the same however it is phrased
+        return {
+            'temperature': stats['day.avgtemp_c'].to_numpy(dtype=float),
+            'precipitation': stats['day.totalprecip_mm'].to_numpy(dtype=float),
+            'rain_day_prob': stats['rain_day_prob'].to_numpy(dtype=float)
+        }
+    
+    def get_location_climate(self, location_name):
+        """Get precomputed climate statistics for a single location"""
+        if self.location_data is None or self.climate_stats is None:
+            return None
+        
+        matches = self.location_data[self.location_data['location.name'] == location_name]
+        if matches.empty or location_name not in self.climate_stats['location'].index:
+            return None
+        
+        return {
+            'location': matches.iloc[0],
+            'overall': self.climate_stats['location'].loc[location_name],
+            'monthly': self.climate_stats['monthly'].xs(location_name, level='location.name')
+        }
+    
     def apply_weights(self, X):
         """Apply weights to features"""
         weighted_X = X.copy()
@@ -76,6 +265,13 @@ class WeightedKMeans:
         # Add cluster labels to location data
         self.location_data['cluster'] = self.cluster_labels_
         
+        # Cluster centers double as a coarse retrieval index
+        self.index_weights = dict(self.feature_weights)
+        self._build_index()
+        
+        # Distribution statistics for scoring and location details
+        self.fit_climate_stats(df)
+        
         return self
     
     def predict(self, df):
@@ -143,7 +339,9 @@ class WeightedKMeans:
             'feature_weights': self.feature_weights,
             'location_data': self.location_data,
             'cluster_labels_': self.cluster_labels_,
-            'cluster_centers_': self.cluster_centers_
+            'cluster_centers_': self.cluster_centers_,
+            'climate_stats': self.climate_stats,
+            'index_weights': self.index_weights
         }
         with open(filepath, 'wb') as f:
             pickle.dump(model_data, f)
@@ -162,45 +360,209 @@ class WeightedKMeans:
         self.location_data = model_data['location_data']
         self.cluster_labels_ = model_data['cluster_labels_']
         self.cluster_centers_ = model_data['cluster_centers_']
+        self.climate_stats = model_data.get('climate_stats')
+        # Older artifacts were saved right after fitting, so their weights match the centers
+        self.index_weights = model_data.get('index_weights', dict(self.feature_weights))
+        self._build_scoring_arrays()
+        self._build_index()
         
         return True
     
-    def find_similar_locations(self, preferences, top_k=5):
-        """Find locations similar to user preferences"""
+    def transform_preferences(self, preferences):
+        """Map the preferred temperature into the scaled, weighted feature space"""
+        feature_columns = list(self.index_weights.keys())
+        position = feature_columns.index('day.avgtemp_c')
+        raw = np.array(self.scaler.mean_, dtype=float)
+        raw[position] = preferences['temperature']
+        scaled = self.scaler.transform(raw.reshape(1, -1))[0]
+        return scaled[position] * self.index_weights['day.avgtemp_c'], position
+    
+    def probe_clusters(self, preferences, nprobe=None, min_candidates=0):
+        """Get candidate rows from the clusters nearest to the preferred temperature
+        
+        Probes at least ``nprobe`` clusters and keeps probing until there are
+        ``min_candidates`` rows. Returns None, meaning every location is a
+        candidate, when ``nprobe`` is None or the query uses preferences
+        outside INDEX_PREFERENCES.
+        """
+        if nprobe is None or 'temperature' not in preferences or set(preferences) - INDEX_PREFERENCES:
+            return None
+        
+        if self._cluster_members is None:
+            self._build_index()
+        if self._cluster_members is None:
+            return None
+        
+        value, position = self.transform_preferences(preferences)
+        order = np.argsort(np.abs(self.cluster_centers_[:, position] - value), kind='stable')
+        
+        selected = []
+        count = 0
+        for probed, cluster_id in enumerate(order):
+            if probed >= nprobe and count >= min_candidates:
+                break
+            selected.append(self._cluster_members[cluster_id])
+            count += len(self._cluster_members[cluster_id])
+        
+        # Keep catalogue order so ties resolve the same way as a full scan
+        return np.sort(np.concatenate(selected))
+    
+    def _resolve_window(self, preferences, indices=None):
+        """Get scoring arrays for the requested trip window, restricted to the given rows
+        
+        ``days`` (0-based day-of-year on a leap-year calendar) takes precedence
+        over a ``months`` set, which takes precedence over a single ``month``.
+        Multi-period windows are reduced with one weighted mean per array.
+        """
+        if self._scoring_arrays is None:
+            self._build_scoring_arrays()
+        rows = slice(None) if indices is None else indices
+        
+        days = preferences.get('days')
+        months = preferences.get('months')
+        windows = self._window_arrays or {}
+        if days is not None and len(days) > 0 and windows.get('daily') is not None:
+            columns = np.asarray(days)
+            return self._reduce_window(windows['daily'], rows, columns, np.ones(len(columns)))
+        if months and len(months) > 1 and windows.get('monthly') is not None:
+            columns = np.asarray(months) - 1
+            return self._reduce_window(windows['monthly'], rows, columns, DAYS_IN_MONTH[columns])
+        
+        month = preferences.get('month') or (months[0] if months else None)
+        arrays = self._scoring_arrays.get(month, self._scoring_arrays[None])
+        return {key: None if values is None else values[rows] for key, values in arrays.items()}
+    
+    def _reduce_window(self, matrices, rows, columns, weights):
+        """Weighted mean of each (location, period) matrix over the window columns"""
+        fallback = self._scoring_arrays[None]
+        reduced = {}
+        for key, matrix in matrices.items():
+            values = matrix[rows][:, columns]
+            valid = ~np.isnan(values)
+            total = (valid * weights).sum(axis=1)
+            weighted = np.where(valid, values, 0.0) @ weights
+            with np.errstate(invalid='ignore', divide='ignore'):
+                # Locations with no observations in the window use their yearly values
+                reduced[key] = np.where(total > 0, weighted / total, fallback[key][rows])
+        return reduced
+    
+    def _score_locations(self, preferences, indices=None):
+        """Score locations (optionally only the given rows) against preferences"""
+        if self._terrains is None or self._regions is None:
+            self._terrains = self.location_data['location.terrain'].fillna('').to_numpy(dtype=object)
+            self._regions = self.location_data['location.region'].fillna('').to_numpy(dtype=object)
+        arrays = self._resolve_window(preferences, indices)
+        
+        size = len(self.location_data) if indices is None else len(indices)
+        scores = np.zeros(size)
+        
+        # Temperature preference
+        if 'temperature' in preferences:
+            temp_diff = np.abs(arrays['temperature'] - preferences['temperature'])
+            scores += np.fmax(0, 10 - temp_diff)  # Higher score for closer temperature
+        
+        # Rain preference, judged by how often it rains rather than the mean amount
+        if 'rain_tolerance' in preferences:
+            rain_tolerance = preferences['rain_tolerance']
+            if arrays['rain_day_prob'] is not None:
+                bands = {'low': (0, 0.3), 'medium': (0.3, 0.6), 'high': (0.6, np.inf)}
+                values = arrays['rain_day_prob']
+            else:
+                bands = {'low': (0, 2), 'medium': (2, 10), 'high': (10, np.inf)}
+                values = arrays['precipitation']
+            if rain_tolerance in bands:
+                lower, upper = bands[rain_tolerance]
+                scores += np.where((values >= lower) & (values < upper), 5, 0)
+        
+        # Terrain preference
+        if 'terrain' in preferences:
+            terrain = preferences['terrain']
+            terrains = self._terrains if indices is None else self._terrains[indices]
+            terrain_match = np.fromiter((terrain in value for value in terrains),
+                                        dtype=bool, count=size)
+            scores += np.where(terrain_match, 3, 0)
+        
+        # Region preference
+        if 'regions' in preferences:
+            regions = self._regions if indices is None else self._regions[indices]
+            scores += np.where(np.isin(regions, preferences['regions']), 3, 0)
+        
+        return scores
+    
+    def find_similar_locations(self, preferences, top_k=5, nprobe=None):
+        """Find locations similar to user preferences
+        
+        Every location is scored unless cluster pruning was opted into with
+        ``nprobe`` (default ``self.nprobe``) and the query is index-servable.
+        """
         if self.location_data is None:
             return []
-            
-        # Calculate similarity scores based on preferences
-        scores = []
-        for idx, row in self.location_data.iterrows():
-            score = 0
-            
-            # Temperature preference
-            if 'temperature' in preferences:
-                temp_pref = preferences['temperature']
-                temp_diff = abs(row['day.avgtemp_c'] - temp_pref)
-                score += max(0, 10 - temp_diff)  # Higher score for closer temperature
-            
-            # Rain preference  
-            if 'rain_tolerance' in preferences:
-                rain_tolerance = preferences['rain_tolerance']
-                if rain_tolerance == 'low' and row['day.totalprecip_mm'] < 2:
-                    score += 5
-                elif rain_tolerance == 'medium' and 2 <= row['day.totalprecip_mm'] < 10:
-                    score += 5
-                elif rain_tolerance == 'high' and row['day.totalprecip_mm'] >= 10:
-                    score += 5
-            
-            # Terrain preference
-            if 'terrain' in preferences:
-                if preferences['terrain'] in row['location.terrain']:
-                    score += 3
-                    
-            scores.append(score)
-        
-        # Get top recommendations
-        self.location_data['score'] = scores
-        recommendations = self.location_data.nlargest(top_k, 'score')
-        
-        return recommendations[['location.name', 'location.region', 'location.terrain', 
-                              'location.lat', 'location.lon', 'cluster', 'score']].to_dict('records')
+        
+        nprobe = self.nprobe if nprobe is None else nprobe
+        candidates = self.probe_clusters(preferences, nprobe=nprobe, min_candidates=top_k)
+        scores = self._score_locations(preferences, candidates)
+        
+        # Get top recommendations (stable sort keeps the first location on ties)
+        top = np.argsort(-scores, kind='stable')[:top_k]
+        rows = top if candidates is None else candidates[top]
+        recommendations = self.location_data.iloc[rows]
+        
+        return LocationRecommendation.from_frame(recommendations, scores[top])
+    
+    def benchmark_retrieval(self, queries=None, top_k=5, nprobe=1, repeat=5):
+        """Compare cluster-pruned retrieval against a full scan
+        
+        Returns recall@k of the pruned results, the average share of locations
+        scored and the mean query time of both paths in milliseconds. The
+        default queries only use preferences the index serves.
+        """
+        if self.location_data is None:
+            return None
+        
+        if queries is None:
+            queries = [{'temperature': temperature} for temperature in range(16, 34)]
+        full_probe = len(self.cluster_centers_)
+        
+        recalls = []
+        scanned = []
+        for query in queries:
+            exact = self.find_similar_locations(query, top_k=top_k, nprobe=full_probe)
+            pruned = self.find_similar_locations(query, top_k=top_k, nprobe=nprobe)
+            exact_names = {rec.name for rec in exact}
+            if exact_names:
+                recalls.append(len(exact_names & {rec.name for rec in pruned}) / len(exact_names))
+            candidates = self.probe_clusters(query, nprobe=nprobe, min_candidates=top_k)
+            scanned.append(1.0 if candidates is None else len(candidates) / len(self.location_data))
+        
+        def timed(probe):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                for query in queries:
+                    self.find_similar_locations(query, top_k=top_k, nprobe=probe)
+            return (time.perf_counter() - start) * 1000 / (repeat * len(queries))
+        
+        return {
+            'queries': len(queries),
+            'top_k': top_k,
+            'nprobe': nprobe,
+            'recall_at_k': float(np.mean(recalls)) if recalls else None,
+            'scanned_fraction': float(np.mean(scanned)),
+            'full_scan_ms': timed(full_probe),
+            'pruned_ms': timed(nprobe)
+        }
+
+
+if __name__ == "__main__":
+    # python -m models.clustering [model_path]
+    import sys
+    
+    model = WeightedKMeans()
+    model_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join("data", "weather_clusters.pkl")
+    if not model.load_model(model_path):
+        sys.exit(f"Model not found: {model_path}")
+    print("top_k nprobe recall scanned full_ms pruned_ms")
+    for top_k in (5, 20):
+        for probe in range(1, len(model.cluster_centers_) + 1):
+            result = model.benchmark_retrieval(top_k=top_k, nprobe=probe)
+            print(f"{top_k:5d} {probe:6d} {result['recall_at_k']:6.2f} {result['scanned_fraction']:7.2f} "
+                  f"{result['full_scan_ms']:7.3f} {result['pruned_ms']:9.3f}")
@@ -0,0 +1,57 @@
+class LocationRecommendation:
+    """Compact, slotted record for a single recommended location.
+
+    Records are built straight from the model's column arrays instead of going
+    through ``DataFrame.to_dict('records')``. The wire format keeps the dotted
+    keys the frontend and chat history already rely on.
+    """
+
+    __slots__ = ('name', 'region', 'terrain', 'lat', 'lon', 'cluster', 'score')
+
+    def __init__(self, name, region, terrain, lat, lon, cluster, score=None):
+        self.name = name
+        self.region = region
+        self.terrain = terrain
+        self.lat = lat
+        self.lon = lon
+        self.cluster = cluster
+        self.score = score
+
+    @classmethod
+    def from_frame(cls, frame, scores=None):
+        """Build records from a location frame using column-wise conversion"""
+        if frame.empty:
+            return []
+
+        if scores is not None:
+            score_column = [float(score) for score in scores]
+        elif 'score' in frame:
+            score_column = frame['score'].tolist()
+        else:
+            score_column = [None] * len(frame)
+
+        columns = (
+            frame['location.name'].tolist(),
+            frame['location.region'].tolist(),
+            frame['location.terrain'].tolist(),
+            frame['location.lat'].tolist(),
+            frame['location.lon'].tolist(),
+            frame['cluster'].tolist(),
+            score_column
+        )
+        return [cls(*values) for values in zip(*columns)]
+
+    def to_dict(self):
+        """Return the API representation with dotted keys"""
+        return {
+            'location.name': self.name,
+            'location.region': self.region,
+            'location.terrain': self.terrain,
+            'location.lat': self.lat,
+            'location.lon': self.lon,
+            'cluster': self.cluster,
+            'score': self.score
+        }
+
+    def __repr__(self):
+        return f"LocationRecommendation({self.name!r}, score={self.score!r})"
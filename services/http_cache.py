@@ -0,0 +1,131 @@
+import gzip
+import hashlib
+from collections import OrderedDict
+
+import brotli
+from fastapi.responses import Response
+
+# Content encodings we produce, in order of preference
+SUPPORTED_ENCODINGS = ("br", "gzip")
+
+# Payloads smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 512
+
+# Moderate levels: payloads are compressed on the event loop on first use,
+# unlike static assets which are compressed at build time
+BROTLI_QUALITY = 5
+GZIP_LEVEL = 6
+
+
+def negotiate_encoding(accept_encoding, available=SUPPORTED_ENCODINGS):
+    """Pick the preferred encoding the client accepts, or None for identity"""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        token, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+
+    for encoding in available:
+        if accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress(body, encoding):
+    """Compress a payload with the given content encoding"""
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body
+
+
+def etag_matches(if_none_match, digest):
+    """Check an If-None-Match header against a payload digest
+
+    Tags may carry a W/ prefix or an encoding suffix; any representation of
+    the same payload counts as a match.
+    """
+    if not if_none_match:
+        return False
+
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        tag = tag.removeprefix("W/").strip('"')
+        if tag.split("-", 1)[0] == digest:
+            return True
+    return False
+
+
+class CachedPayload:
+    """An encoded response body with its ETag and lazily compressed variants"""
+
+    __slots__ = ("body", "media_type", "digest", "_variants")
+
+    def __init__(self, body, media_type="application/json"):
+        self.body = body
+        self.media_type = media_type
+        self.digest = hashlib.sha256(body).hexdigest()[:20]
+        self._variants = {None: body}
+
+    def variant(self, encoding):
+        """Get the body in the given encoding, compressing it on first use"""
+        if encoding not in self._variants:
+            self._variants[encoding] = compress(self.body, encoding)
+        return self._variants[encoding]
+
+    def response(self, request, cache_control):
+        """Build a negotiated response, or 304 when the client copy is current"""
+        encoding = None
+        if len(self.body) >= MIN_COMPRESS_SIZE:
+            encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+
+        etag = f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+        headers = {
+            "ETag": etag,
+            "Cache-Control": cache_control,
+            "Vary": "Accept-Encoding"
+        }
+
+        if etag_matches(request.headers.get("if-none-match"), self.digest):
+            return Response(status_code=304, headers=headers)
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=self.variant(encoding), media_type=self.media_type, headers=headers)
+
+
+class PayloadCache:
+    """Bounded LRU cache of encoded response payloads"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        payload = self._entries.get(key)
+        if payload is not None:
+            self._entries.move_to_end(key)
+        return payload
+
+    def put(self, key, body, media_type="application/json"):
+        payload = CachedPayload(body, media_type)
+        self._entries[key] = payload
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return payload
+
+    def clear(self):
+        self._entries.clear()
@@ -2,10 +2,28 @@ import openai
 import os
 import json
 import re
+from datetime import date, timedelta
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Markers that make a short message read as a refinement of the previous request
+FOLLOW_UP_MARKERS = ["còn", "thì sao", "nữa", "khác", "thay vào", "thay vì",
+                     "what about", "how about", "instead"]
+
+# Longer messages are treated as new requests even if they contain a marker
+MAX_FOLLOW_UP_WORDS = 12
+
+
+def contains_any(text, words):
+    """Check whether any of the words or phrases occurs in text as whole words
+    
+    A trailing "*" also matches longer words, e.g. "hill*" matches "hills".
+    """
+    patterns = [re.escape(word[:-1]) + r"\w*" if word.endswith("*") else re.escape(word) for word in words]
+    return re.search(r"\b(?:" + "|".join(patterns) + r")\b", text) is not None
+
+
 class OpenAIService:
     def __init__(self):
         self.client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
@@ -19,13 +37,22 @@ class OpenAIService:
         
         {
             "month": số tháng (1-12) hoặc null,
+            "months": [các tháng (1-12) của chuyến đi theo thứ tự] hoặc null,
+            "date_range": {"start": "MM-DD", "end": "MM-DD"} hoặc null,
             "temperature_preference": "mát" | "ôn hòa" | "nóng" | null,
             "rain_tolerance": "ít" | "vừa" | "nhiều" | null,
             "terrain_preference": "miền núi" | "ven biển" | "đồng bằng" | null,
+            "region_preference": "miền Bắc" | "miền Trung" | "miền Nam" | null,
             "activity_type": "nghỉ dưỡng" | "khám phá" | "thể thao" | "văn hóa" | null,
             "keywords": ["từ khóa quan trọng từ tin nhắn"]
         }
         
+        Nếu chuyến đi kéo dài nhiều tháng, liệt kê tất cả các tháng trong "months",
+        ví dụ "từ tháng 11 đến tháng 2" -> [11, 12, 1, 2].
+        Nếu có khoảng ngày cụ thể, điền "date_range",
+        ví dụ "chuyến đi 10 ngày cuối tháng 12" -> {"start": "12-21", "end": "12-30"}.
+        "month" là tháng đầu tiên của chuyến đi.
+        
         Chỉ trả về JSON, không có text khác.
         """
         
@@ -58,9 +85,12 @@ class OpenAIService:
         """Fallback parsing method if OpenAI fails"""
         preferences = {
             "month": None,
+            "months": None,
+            "date_range": None,
             "temperature_preference": None,
             "rain_tolerance": None,
             "terrain_preference": None,
+            "region_preference": None,
             "activity_type": None,
             "keywords": []
         }
@@ -75,38 +105,119 @@ class OpenAIService:
             "january": 1, "february": 2, "march": 3, "april": 4,
             "may": 5, "june": 6, "july": 7, "august": 8,
             "september": 9, "october": 10, "november": 11, "december": 12,
-            "xuân": 3, "hè": 6, "thu": 9, "đông": 12 
+            "mùa xuân": 3, "mùa hè": 6, "mùa thu": 9, "mùa đông": 12
         }
         
-        for month_str, month_num in months.items():
-            if month_str in message_lower:
-                preferences["month"] = month_num
+        # Longest names first so "tháng 11" is not read as "tháng 1"
+        for month_str in sorted(months, key=len, reverse=True):
+            if contains_any(message_lower, [month_str]):
+                preferences["month"] = months[month_str]
                 break
         
+        # Extract month ranges such as "từ tháng 11 đến tháng 2" and month sets
+        # such as "tháng 7 và tháng 8", in the order they appear
+        found = []
+        consumed = []
+        range_pattern = r"tháng\s*(\d{1,2})\s*(?:đến|tới|-|–)\s*(?:hết\s*)?tháng\s*(\d{1,2})\b(?!\s*-?\s*(?:ngày|day))"
+        for range_match in re.finditer(range_pattern, message_lower):
+            first, last = int(range_match.group(1)), int(range_match.group(2))
+            if 1 <= first <= 12 and 1 <= last <= 12:
+                span = [(first - 1 + i) % 12 + 1 for i in range((last - first) % 12 + 1)]
+                found.append((range_match.start(), span))
+                consumed.append(range_match.span())
+        for month_match in re.finditer(r"\btháng\s*(\d{1,2})\b", message_lower):
+            if any(start <= month_match.start() < end for start, end in consumed):
+                continue
+            month = int(month_match.group(1))
+            if 1 <= month <= 12:
+                found.append((month_match.start(), [month]))
+        
+        trip_months = []
+        for _, span in sorted(found):
+            trip_months.extend(month for month in span if month not in trip_months)
+        if trip_months:
+            preferences["month"] = trip_months[0]
+        if len(trip_months) > 1:
+            preferences["months"] = trip_months
+        
+        # Extract date ranges such as "10 ngày cuối tháng 12" or "a 10-day trip in late December"
+        preferences["date_range"] = self._parse_date_range_fallback(message_lower, preferences["month"])
+        
         # Extract temperature preference
-        if any(word in message_lower for word in ["mát", "lạnh", "cool", "cold"]):
+        if contains_any(message_lower, ["mát", "lạnh", "cool*", "cold*"]):
             preferences["temperature_preference"] = "mát"
-        elif any(word in message_lower for word in ["nóng", "hot", "warm"]):
+        elif contains_any(message_lower, ["nóng", "hot", "hotter", "hottest", "warm*"]):
             preferences["temperature_preference"] = "nóng"
-        elif any(word in message_lower for word in ["ôn hòa", "dễ chịu", "mild"]):
+        elif contains_any(message_lower, ["ôn hòa", "dễ chịu", "mild*"]):
             preferences["temperature_preference"] = "ôn hòa"
         
         # Extract rain tolerance
-        if any(word in message_lower for word in ["ít mưa", "khô", "dry"]):
+        if contains_any(message_lower, ["ít mưa", "khô", "dry", "drier", "driest"]):
             preferences["rain_tolerance"] = "ít"
-        elif any(word in message_lower for word in ["nhiều mưa", "mưa", "rain"]):
+        elif contains_any(message_lower, ["nhiều mưa", "mưa", "rain*"]):
             preferences["rain_tolerance"] = "nhiều"
         
         # Extract terrain preference
-        if any(word in message_lower for word in ["núi", "mountain", "hill"]):
+        if contains_any(message_lower, ["núi", "mountain*", "hill*"]):
             preferences["terrain_preference"] = "miền núi"
-        elif any(word in message_lower for word in ["biển", "beach", "coast", "ven biển"]):
+        elif contains_any(message_lower, ["biển", "beach*", "coast*", "ven biển"]):
             preferences["terrain_preference"] = "ven biển"
-        elif any(word in message_lower for word in ["đồng bằng", "plain", "delta"]):
+        elif contains_any(message_lower, ["đồng bằng", "plain*", "delta*"]):
             preferences["terrain_preference"] = "đồng bằng"
         
+        # Extract region preference
+        if contains_any(message_lower, ["miền bắc", "phía bắc", "north*"]):
+            preferences["region_preference"] = "miền Bắc"
+        elif contains_any(message_lower, ["miền trung", "central"]):
+            preferences["region_preference"] = "miền Trung"
+        elif contains_any(message_lower, ["miền nam", "phía nam", "south*"]):
+            preferences["region_preference"] = "miền Nam"
+        
         return preferences
     
+    def extract_refinement(self, user_message):
+        """Extract a preference delta from a follow-up message without calling OpenAI
+        
+        Returns only the fields the message mentions, an empty dict for a
+        follow-up that changes nothing (e.g. "còn chỗ nào khác không?"), or
+        None when the message does not read as a refinement of the previous
+        request.
+        """
+        message_lower = user_message.lower()
+        if len(message_lower.split()) > MAX_FOLLOW_UP_WORDS:
+            return None
+        if not contains_any(message_lower, FOLLOW_UP_MARKERS):
+            return None
+        
+        parsed = self._parse_fallback(user_message)
+        return {key: value for key, value in parsed.items() if value and key != "keywords"}
+    
+    def _parse_date_range_fallback(self, message_lower, month):
+        """Build a date range from a trip length and/or part of a month"""
+        if not month:
+            return None
+        
+        duration_match = re.search(r"(\d{1,3})\s*-?\s*(?:ngày|days?)\b", message_lower)
+        part_starts = {
+            r"đầu tháng|\bearly\b": 1,
+            r"giữa tháng|\bmid\b": 11,
+            r"cuối tháng|\blate\b": 21
+        }
+        start_day = next((day for part, day in part_starts.items() if re.search(part, message_lower)), None)
+        if duration_match is None and start_day is None:
+            return None
+        
+        # Leap-year calendar so February 29 is always valid
+        start = date(2024, month, start_day or 1)
+        if duration_match:
+            end = start + timedelta(days=max(int(duration_match.group(1)), 1) - 1)
+        elif start_day == 21:
+            end = date(2024 + (month == 12), month % 12 + 1, 1) - timedelta(days=1)
+        else:
+            end = start + timedelta(days=9)
+        
+        return {"start": start.strftime("%m-%d"), "end": end.strftime("%m-%d")}
+    
     def generate_response(self, user_message, recommendations, preferences):
         """Generate a natural response with recommendations"""
         
@@ -121,10 +232,10 @@ class OpenAIService:
         # Prepare recommendation text
         rec_text = "Dựa trên yêu cầu của bạn, tôi khuyến nghị các địa điểm sau:\n\n"
         for i, rec in enumerate(recommendations[:5], 1):
-            rec_text += f"{i}. {rec['location.name']} ({rec['location.region']})\n"
-            rec_text += f"   - Địa hình: {rec['location.terrain']}\n"
-            if 'score' in rec:
-                rec_text += f"   - Độ phù hợp: {rec['score']:.1f}/10\n"
+            rec_text += f"{i}. {rec.name} ({rec.region})\n"
+            rec_text += f"   - Địa hình: {rec.terrain}\n"
+            if rec.score is not None:
+                rec_text += f"   - Độ phù hợp: {rec.score:.1f}/10\n"
             rec_text += "\n"
         
         user_prompt = f"""
@@ -162,8 +273,35 @@ class OpenAIService:
         
         response = "Dựa trên yêu cầu của bạn, tôi khuyến nghị các địa điểm sau:\n\n"
         for i, rec in enumerate(recommendations[:3], 1):
-            response += f"{i}. {rec['location.name']} - {rec['location.region']}\n"
-            response += f"   Địa hình: {rec['location.terrain']}\n\n"
+            response += f"{i}. {rec.name} - {rec.region}\n"
+            response += f"   Địa hình: {rec.terrain}\n\n"
         
         response += "Những địa điểm này có điều kiện thời tiết phù hợp với sở thích của bạn!"
         return response
+
+
+if __name__ == "__main__":
+    # python -m services.openai_service: regression check for the fallback parser
+    service = OpenAIService.__new__(OpenAIService)  # parsing needs no API client
+    examples = {
+        "Mountains with cooler weather in November": {
+            "temperature_preference": "mát", "terrain_preference": "miền núi", "month": 11},
+        "beaches, hot, rainy season is fine": {
+            "terrain_preference": "ven biển", "rain_tolerance": "nhiều"},
+        "somewhere warmer in the hills": {
+            "temperature_preference": "nóng", "terrain_preference": "miền núi"},
+        "coastal places with dry weather": {
+            "terrain_preference": "ven biển", "rain_tolerance": "ít"},
+        "a hotel in the northern mountains": {
+            "temperature_preference": None, "region_preference": "miền Bắc"},
+        "thuê xe đi tháng 11, khí hậu khô": {
+            "month": 11, "rain_tolerance": "ít", "temperature_preference": None},
+        "tháng 7 và tháng 8": {"month": 7, "months": [7, 8]}
+    }
+    for message, expected in examples.items():
+        parsed = service._parse_fallback(message)
+        mismatches = {key: parsed[key] for key, value in expected.items() if parsed[key] != value}
+        print(f"{'ok' if not mismatches else 'FAIL'}: {message} {mismatches or ''}")
+    
+    refinement = service.extract_refinement("What about somewhere cooler?")
+    print(f"{'ok' if refinement == {'temperature_preference': 'mát'} else 'FAIL'}: What about somewhere cooler? {refinement}")
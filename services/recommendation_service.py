@@ -1,14 +1,36 @@
 import pandas as pd
 import numpy as np
-from models.clustering import WeightedKMeans
+from models.clustering import WeightedKMeans, CLIMATE_STAT_COLUMNS
 from services.openai_service import OpenAIService
+from services.session_store import SessionStore
 import json
+from datetime import date
+
+# Regions in the weather data grouped by the broad area users ask about
+REGION_GROUPS = {
+    "miền Bắc": ["Đông Bắc Bộ", "Tây Bắc Bộ", "Đồng Bằng Sông Hồng"],
+    "miền Trung": ["Bắc Trung Bộ", "Nam Trung Bộ", "Tây Nguyên"],
+    "miền Nam": ["Đông Nam Bộ", "Đồng Bằng Sông Cửu Long"]
+}
+
+# Ranked candidates kept per session so follow-ups can be re-ranked locally
+SESSION_CANDIDATES = 20
+
+# Recommendations returned per request; a local refinement leaving fewer re-scores
+TOP_RECOMMENDATIONS = 5
+
+# Preferences a follow-up can change by filtering the cached candidates
+LOCAL_REFINEMENT_FIELDS = {'terrain_preference', 'region_preference'}
+
+# Preferences describing when the trip happens; a new value replaces all of them
+TRIP_WINDOW_FIELDS = ('month', 'months', 'date_range')
 
 class RecommendationService:
     def __init__(self, weather_data_path=r"data\df_weather.csv"):
         self.weather_data_path = weather_data_path
         self.clustering_model = WeightedKMeans(n_clusters=8)
         self.openai_service = OpenAIService()
+        self.sessions = SessionStore(max_sessions=1000, ttl_seconds=1800)
         self.df = None
         self.model_trained = False
         
@@ -34,6 +56,11 @@ class RecommendationService:
         
         if not force_retrain and self.clustering_model.load_model(model_path):
             print("Loaded existing clustering model")
+            if self.clustering_model.needs_climate_stats() and self.df is not None:
+                # Older artifacts predate climate statistics; add them once
+                self.clustering_model.fit_climate_stats(self.df)
+                self.clustering_model.save_model(model_path)
+                print("Added climate statistics to clustering model")
             self.model_trained = True
             return True
         
@@ -83,8 +110,14 @@ class RecommendationService:
             return self.df[self.df['month'] == month]
         return self.df
     
-    def get_recommendations(self, user_message):
-        """Get travel recommendations based on user message"""
+    def get_recommendations(self, user_message, user_id=None):
+        """Get travel recommendations based on user message
+        
+        With a ``user_id`` (other than "anonymous") the last preferences and
+        ranked candidates are kept, and a follow-up message is applied to them
+        as a delta instead of re-running extraction and scoring. A follow-up
+        that changes nothing pages through the remaining candidates.
+        """
         if not self.model_trained:
             if not self.train_clustering_model():
                 return {
@@ -94,26 +127,56 @@ class RecommendationService:
                 }
         
         try:
-            # Extract preferences using OpenAI
-            preferences = self.openai_service.extract_travel_preferences(user_message)
-            print(f"Extracted preferences: {preferences}")
+            session = None
+            if user_id and user_id != "anonymous":
+                session = self.sessions.get(user_id)
+            delta = self.openai_service.extract_refinement(user_message) if session else None
             
-            # Update clustering weights based on preferences
-            self.update_weights_from_preferences(preferences)
+            recommendations = None
+            offset = 0
+            if delta == {}:
+                # Follow-up asking for other places: show the next page of candidates
+                preferences = session.preferences
+                candidates = session.candidates
+                recommendations = self._apply_preference_filters(candidates, preferences)
+                offset = session.offset + TOP_RECOMMENDATIONS
+                if offset >= len(recommendations):
+                    offset = 0  # All candidates shown; start over from the best
+                print(f"Showing candidates {offset + 1}-{offset + TOP_RECOMMENDATIONS}")
+            elif delta is not None:
+                # Follow-up: apply the delta to the previous request
+                preferences = self._merge_preferences(session.preferences, delta)
+                print(f"Refined preferences: {delta}")
+                candidates = session.candidates
+                if set(delta) <= LOCAL_REFINEMENT_FIELDS:
+                    recommendations = self._filter_candidates(candidates, preferences)
+                    if len(recommendations) < TOP_RECOMMENDATIONS:
+                        # Too few cached matches; re-score the whole catalogue
+                        recommendations = None
+            else:
+                # Extract preferences using OpenAI
+                preferences = self.openai_service.extract_travel_preferences(user_message)
+                print(f"Extracted preferences: {preferences}")
             
-            # Filter data by month if specified
-            filtered_df = self.filter_by_month(preferences.get('month'))
+            if not recommendations:
+                # Update clustering weights based on preferences
+                self.update_weights_from_preferences(preferences)
+                
+                # Convert preferences to numerical values for similarity calculation
+                numerical_preferences = self._convert_preferences_to_numerical(preferences)
+                
+                # Get recommendations using clustering model
+                candidates = self.clustering_model.find_similar_locations(
+                    numerical_preferences, top_k=SESSION_CANDIDATES
+                )
+                
+                # Apply additional filtering based on preferences
+                recommendations = self._apply_preference_filters(candidates, preferences)
             
-            # Convert preferences to numerical values for similarity calculation
-            numerical_preferences = self._convert_preferences_to_numerical(preferences)
-            
-            # Get recommendations using clustering model
-            recommendations = self.clustering_model.find_similar_locations(
-                numerical_preferences, top_k=8
-            )
+            if user_id and user_id != "anonymous":
+                self.sessions.put(user_id, preferences, candidates, offset)
             
-            # Apply additional filtering based on preferences
-            recommendations = self._apply_preference_filters(recommendations, preferences)
+            recommendations = recommendations[offset:offset + TOP_RECOMMENDATIONS]
             
             # Generate natural language response
             response = self.openai_service.generate_response(
@@ -122,9 +185,8 @@ class RecommendationService:
             
             return {
                 "preferences": preferences,
-                "recommendations": recommendations[:5],  # Top 5 recommendations
-                "response": response,
-                "cluster_info": self.clustering_model.get_cluster_characteristics()
+                "recommendations": recommendations,
+                "response": response
             }
             
         except Exception as e:
@@ -139,6 +201,15 @@ class RecommendationService:
         """Convert text preferences to numerical values"""
         numerical = {}
         
+        # Trip window selects the precomputed monthly or day-of-year climate statistics
+        months = self._parse_months(preferences)
+        if months:
+            numerical['month'] = months[0]
+            numerical['months'] = months
+        days = self._parse_date_range(preferences.get('date_range'))
+        if days is not None:
+            numerical['days'] = days
+        
         # Temperature mapping
         temp_map = {"mát": 22, "ôn hòa": 26, "nóng": 32}
         if preferences.get('temperature_preference'):
@@ -153,26 +224,89 @@ class RecommendationService:
         if preferences.get('terrain_preference'):
             numerical['terrain'] = preferences['terrain_preference']
         
+        # Region preference
+        if preferences.get('region_preference') in REGION_GROUPS:
+            numerical['regions'] = REGION_GROUPS[preferences['region_preference']]
+        
         return numerical
     
+    def _merge_preferences(self, previous, delta):
+        """Apply a follow-up preference delta to the previous preferences"""
+        merged = dict(previous)
+        if any(field in delta for field in TRIP_WINDOW_FIELDS):
+            for field in TRIP_WINDOW_FIELDS:
+                merged[field] = None
+        merged.update(delta)
+        return merged
+    
+    def _parse_months(self, preferences):
+        """Get the trip months (1-12) in travel order from 'months' or 'month'"""
+        raw_months = preferences.get('months') or []
+        if not raw_months and preferences.get('month'):
+            raw_months = [preferences['month']]
+        
+        months = []
+        for month in raw_months:
+            try:
+                month = int(month)
+            except (TypeError, ValueError):
+                continue
+            if 1 <= month <= 12 and month not in months:
+                months.append(month)
+        return months
+    
+    def _parse_date_range(self, date_range):
+        """Convert a {'start', 'end'} date range into 0-based day-of-year indices
+        
+        Dates are 'MM-DD' or 'YYYY-MM-DD'; the year is ignored and a range whose
+        end precedes its start wraps around the new year.
+        """
+        if not isinstance(date_range, dict):
+            return None
+        
+        try:
+            start, end = (self._day_of_year(date_range[key]) for key in ('start', 'end'))
+        except (KeyError, TypeError, ValueError):
+            return None
+        
+        if end >= start:
+            return np.arange(start, end + 1)
+        return np.concatenate([np.arange(start, 366), np.arange(0, end + 1)])
+    
+    def _day_of_year(self, value):
+        """0-based day-of-year of an 'MM-DD' or 'YYYY-MM-DD' string on a leap-year calendar"""
+        month, day = (int(part) for part in str(value).split('-')[-2:])
+        return (date(2024, month, day) - date(2024, 1, 1)).days
+    
     def _apply_preference_filters(self, recommendations, preferences):
         """Apply additional filtering based on preferences"""
         if not recommendations:
             return recommendations
         
+        filtered = self._filter_candidates(recommendations, preferences)
+        return filtered if filtered else recommendations  # Return original if no matches
+    
+    def _filter_candidates(self, recommendations, preferences):
+        """Keep the candidates matching the terrain and region preferences, in rank order"""
+        regions = REGION_GROUPS.get(preferences.get('region_preference'))
+        
         filtered = []
         for rec in recommendations:
             include = True
             
             # Filter by terrain if specified
             if preferences.get('terrain_preference'):
-                if preferences['terrain_preference'] not in rec.get('location.terrain', ''):
+                if preferences['terrain_preference'] not in (rec.terrain or ''):
                     include = False
             
+            # Filter by region if specified
+            if regions and rec.region not in regions:
+                include = False
+            
             if include:
                 filtered.append(rec)
         
-        return filtered if filtered else recommendations  # Return original if no matches
+        return filtered
     
     def get_cluster_analysis(self):
         """Get detailed cluster analysis"""
@@ -183,36 +317,41 @@ class RecommendationService:
     
     def get_location_details(self, location_name):
         """Get detailed weather information for a specific location"""
-        if self.df is None:
+        climate = self.clustering_model.get_location_climate(location_name)
+        if climate is None:
             return None
         
-        location_data = self.df[self.df['location.name'] == location_name]
-        if location_data.empty:
-            return None
+        location = climate['location']
+        overall = climate['overall']
+        monthly = climate['monthly']
         
-        # Calculate monthly averages
-        monthly_stats = location_data.groupby('month').agg({
-            'day.avgtemp_c': 'mean',
-            'day.totalprecip_mm': 'mean',
-            'day.avghumidity': 'mean',
-            'day.maxwind_kph': 'mean',
-            'day.uv': 'mean'
-        }).round(2)
+        # Monthly averages come from the precomputed statistics
+        monthly_stats = monthly[[
+            'day.avgtemp_c',
+            'day.totalprecip_mm',
+            'day.avghumidity',
+            'day.maxwind_kph',
+            'day.uv'
+        ]].round(2)
         
         return {
             'location_info': {
                 'name': location_name,
-                'region': location_data['location.region'].iloc[0],
-                'terrain': location_data['location.terrain'].iloc[0],
-                'latitude': location_data['location.lat'].iloc[0],
-                'longitude': location_data['location.lon'].iloc[0]
+                'region': location['location.region'],
+                'terrain': location['location.terrain'],
+                'latitude': location['location.lat'],
+                'longitude': location['location.lon']
             },
             'monthly_averages': monthly_stats.to_dict('index'),
             'overall_averages': {
-                'temperature': location_data['day.avgtemp_c'].mean(),
-                'precipitation': location_data['day.totalprecip_mm'].mean(),
-                'humidity': location_data['day.avghumidity'].mean(),
-                'wind_speed': location_data['day.maxwind_kph'].mean(),
-                'uv_index': location_data['day.uv'].mean()
+                'temperature': overall['day.avgtemp_c'],
+                'precipitation': overall['day.totalprecip_mm'],
+                'humidity': overall['day.avghumidity'],
+                'wind_speed': overall['day.maxwind_kph'],
+                'uv_index': overall['day.uv']
+            },
+            'climate_statistics': {
+                'overall': overall[CLIMATE_STAT_COLUMNS].round(2).to_dict(),
+                'monthly': monthly[CLIMATE_STAT_COLUMNS].round(2).to_dict('index')
             }
         }
@@ -0,0 +1,29 @@
+import orjson
+from fastapi.responses import JSONResponse
+
+from models.recommendation import LocationRecommendation
+
+# Numpy scalars/arrays come out of pandas aggregations and monthly stats are
+# keyed by integer month, so both options are needed on every payload.
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Marks an already encoded JSON document so it is embedded verbatim
+Fragment = orjson.Fragment
+
+
+def _default(obj):
+    if isinstance(obj, LocationRecommendation):
+        return obj.to_dict()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj):
+    """Serialize an object to UTF-8 JSON bytes"""
+    return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with orjson"""
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+
+from services.serialization import dumps
+
+
+class SessionState:
+    """Last structured preferences and ranked candidates for one user
+
+    ``offset`` is the position of the page of recommendations last shown.
+    """
+
+    __slots__ = ('preferences', 'candidates', 'offset', 'updated_at', 'size')
+
+    def __init__(self, preferences, candidates, offset=0):
+        self.preferences = preferences
+        self.candidates = candidates
+        self.offset = offset
+        self.updated_at = time.monotonic()
+        # Encoded size is a cheap, stable proxy for the memory a session holds
+        self.size = len(dumps(preferences)) + len(dumps(candidates))
+
+
+class SessionStore:
+    """Bounded in-memory LRU of conversation sessions with a TTL
+
+    Sessions are evicted least recently used first once either the session
+    count or the total estimated size exceeds its cap.
+    """
+
+    def __init__(self, max_sessions=1000, ttl_seconds=1800, max_bytes=16 * 1024 * 1024):
+        self.max_sessions = max_sessions
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._sessions = OrderedDict()
+
+    def get(self, user_id):
+        """Get a live session, dropping it if it has expired"""
+        session = self._sessions.get(user_id)
+        if session is None:
+            return None
+
+        if time.monotonic() - session.updated_at > self.ttl_seconds:
+            self.pop(user_id)
+            return None
+
+        self._sessions.move_to_end(user_id)
+        return session
+
+    def put(self, user_id, preferences, candidates, offset=0):
+        """Store the latest state for a user and enforce the caps"""
+        self.pop(user_id)
+        session = SessionState(preferences, candidates, offset)
+        self._sessions[user_id] = session
+        self.total_bytes += session.size
+
+        while self._sessions and (len(self._sessions) > self.max_sessions
+                                  or self.total_bytes > self.max_bytes):
+            _, evicted = self._sessions.popitem(last=False)
+            self.total_bytes -= evicted.size
+        return session
+
+    def pop(self, user_id):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            self.total_bytes -= session.size
+        return session
+
+    def __len__(self):
+        return len(self._sessions)
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import stat
+
+import anyio
+import brotli
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from services.http_cache import negotiate_encoding
+
+# Assets that are fingerprinted and precompressed at build time
+ASSET_EXTENSIONS = (".js", ".css")
+
+# Build output, served under /static/dist
+DIST_DIR = "dist"
+MANIFEST_NAME = "manifest.json"
+
+# Precompressed variants, in order of preference
+ENCODING_SUFFIXES = (("br", ".br"), ("gzip", ".gz"))
+
+# Matches fingerprinted file names such as script.3f2a9c1b7d4e.js
+HASHED_NAME = re.compile(r"\.[0-9a-f]{12}\.[a-z0-9]+$")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+
+def build_static_assets(static_dir="static"):
+    """Write content-hashed, gzip and brotli variants of the static assets
+
+    Returns the manifest mapping each source name to its hashed name. Outputs
+    of the previous build are kept; older ones are removed.
+    """
+    dist_dir = os.path.join(static_dir, DIST_DIR)
+    os.makedirs(dist_dir, exist_ok=True)
+    previous = load_manifest(static_dir)
+
+    manifest = {}
+    for name in sorted(os.listdir(static_dir)):
+        source = os.path.join(static_dir, name)
+        if not name.endswith(ASSET_EXTENSIONS) or not os.path.isfile(source):
+            continue
+
+        with open(source, "rb") as f:
+            content = f.read()
+
+        stem, ext = os.path.splitext(name)
+        hashed_name = f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+        target = os.path.join(dist_dir, hashed_name)
+
+        variants = {
+            target: content,
+            target + ".gz": gzip.compress(content, compresslevel=9, mtime=0),
+            target + ".br": brotli.compress(content, quality=11)
+        }
+        for path, data in variants.items():
+            with open(path, "wb") as f:
+                f.write(data)
+
+        manifest[name] = hashed_name
+
+    # Keep the previous build so pages rendered against it by a running server
+    # still resolve; anything older is no longer referenced and is removed
+    retained = set(manifest.values()) | set(previous.values())
+    for file_name in os.listdir(dist_dir):
+        hashed_name = file_name
+        for _, suffix in ENCODING_SUFFIXES:
+            if hashed_name.endswith(suffix):
+                hashed_name = hashed_name[:-len(suffix)]
+        if HASHED_NAME.search(hashed_name) and hashed_name not in retained:
+            os.remove(os.path.join(dist_dir, file_name))
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+
+    return manifest
+
+
+def load_manifest(static_dir="static"):
+    """Load the asset manifest, or an empty one if assets were not built"""
+    path = os.path.join(static_dir, DIST_DIR, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+class AssetUrls:
+    """Resolve static asset URLs to their fingerprinted build output when available"""
+
+    def __init__(self, static_dir="static", url_prefix="/static"):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix
+        self.manifest = {}
+
+    def reload(self):
+        self.manifest = load_manifest(self.static_dir)
+
+    def __call__(self, name):
+        hashed_name = self.manifest.get(name)
+        if hashed_name is None:
+            return f"{self.url_prefix}/{name}"
+        return f"{self.url_prefix}/{DIST_DIR}/{hashed_name}"
+
+
+class PrecompressedStaticFiles(StaticFiles):
+    """StaticFiles that serves .br/.gz siblings when the client accepts them
+
+    Fingerprinted files are marked immutable; everything else must be
+    revalidated with its ETag.
+    """
+
+    async def get_response(self, path, scope):
+        # Compressed siblings are only served through negotiation, never directly
+        if path.endswith(tuple(suffix for _, suffix in ENCODING_SUFFIXES)):
+            raise HTTPException(status_code=404)
+
+        request_headers = Headers(scope=scope)
+        accept_encoding = request_headers.get("accept-encoding")
+
+        response = None
+        if scope["method"] in ("GET", "HEAD"):
+            for encoding, suffix in ENCODING_SUFFIXES:
+                if negotiate_encoding(accept_encoding, (encoding,)) is None:
+                    continue
+                response = await self._precompressed_response(path, suffix, encoding, request_headers)
+                if response is not None:
+                    break
+
+        if response is None:
+            response = await super().get_response(path, scope)
+
+        if response.status_code in (200, 304):
+            response.headers["Cache-Control"] = (
+                IMMUTABLE_CACHE_CONTROL if HASHED_NAME.search(path) else REVALIDATE_CACHE_CONTROL
+            )
+            response.headers["Vary"] = "Accept-Encoding"
+        return response
+
+    async def _precompressed_response(self, path, suffix, encoding, request_headers):
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path + suffix)
+        if stat_result is None or not stat.S_ISREG(stat_result.st_mode):
+            return None
+
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        response = FileResponse(
+            full_path,
+            stat_result=stat_result,
+            media_type=media_type,
+            headers={"Content-Encoding": encoding}
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+if __name__ == "__main__":
+    # python -m services.static_assets
+    for source, hashed in build_static_assets().items():
+        print(f"{source} -> {DIST_DIR}/{hashed}")
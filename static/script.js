@@ -2,6 +2,7 @@
 let map;
 let markersLayer;
 let currentRecommendations = [];
+let conversationId = newConversationId();
 
 // Initialize the application
 document.addEventListener('DOMContentLoaded', function() {
@@ -10,6 +11,14 @@ document.addEventListener('DOMContentLoaded', function() {
     loadChatHistory();
 });
 
+// Identify this conversation so follow-up messages refine the previous request
+function newConversationId() {
+    if (window.crypto && crypto.randomUUID) {
+        return crypto.randomUUID();
+    }
+    return 'conv-' + Date.now().toString(36) + '-' + Math.random().toString(36).slice(2);
+}
+
 // Initialize Leaflet map
 function initializeMap() {
     // Initialize map centered on Vietnam
@@ -94,7 +103,7 @@ async function sendMessage() {
             },
             body: JSON.stringify({
                 message: message,
-                user_id: 'anonymous'
+                user_id: conversationId
             })
         });
         
@@ -276,6 +285,7 @@ function showLoading(show) {
 
 // Clear chat history
 function clearChat() {
+    conversationId = newConversationId();
     const chatContainer = document.getElementById('chatContainer');
     chatContainer.innerHTML = `
         <div class="welcome-message">